@@ -1,185 +1,320 @@
 import streamlit as st
+import base64
+import collections
+import hashlib
+import io
+import json
 import os
-import shutil
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import create_map_poster
-from create_map_poster import create_poster, load_theme, get_coordinates
-import os
-from pathlib import Path
-import osmnx as ox
-import matplotlib.font_manager as fm
+
+from PIL import Image
 
 # 強制定義快取位置
 CACHE_DIR = Path("cache")
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
-# 徹底設定 ox 的路徑，避免它亂跑
-ox.settings.cache_folder = str(CACHE_DIR.absolute())
-ox.settings.use_cache = True
-ox.settings.log_console = False  # 關閉日誌寫入檔案，這常引起權限錯誤
+# 設定預覽圖目錄 (剛才生成的三色帶 PNG)；路徑只在匯入時建立一次
+PREVIEW_DIR = Path("theme_previews")
+
+# 檔名中只保留文字、數字、底線與連字號，避免路徑穿越或無法寫入的檔名
+_SAFE = re.compile(r'[^\w-]+')
+
+# 文字大小與線條粗細：選項以索引儲存，直接對應比例係數
+_SIZE_LABELS = ("小 S", "中 M", "大 L")
+_SIZE_SCALES = (0.7, 1.0, 1.4)
+_LINE_LABELS = ("細 Light", "標準 Regular", "粗 Bold")
+_LINE_SCALES = (0.6, 1.0, 1.6)
+
+# 頁尾 HTML/CSS 為固定內容，定義為模組常數
+_FOOTER_HTML = """
+<style>
+.footer {
+    position: fixed;
+    left: 0;
+    bottom: 0;
+    width: 100%;
+    background-color: rgba(0, 0, 0, 0.7); 
+    color: gray;
+    text-align: center;
+    padding: 10px 0;
+    font-size: 0.8em;
+    z-index: 999;
+}
+.footer a {
+    text-decoration: none;
+}
+.main .block-container {
+    padding-bottom: 80px;
+}
+</style>
+<div class="footer">
+    <span>Source:</span>
+    <a href="https://github.com/originalankur/maptoposter" target="_blank">
+        <img src="https://flat.badgen.net/badge/icon/github?icon=github&label=originalankur/maptoposter&color=black">
+    </a>
+    <span style="margin-left:15px;">Made by:</span>
+    <a href="https://github.com/ynancy22/map-app" target="_blank">
+        <img src="https://flat.badgen.net/badge/icon/github?icon=github&label=ynancy22/map-app&color=cyan">
+    </a>
+</div>
+"""
+
+
+# 徹底設定 ox 的路徑，避免它亂跑。osmnx 匯入成本高，延後到第一次需要時，
+# 每個程序只設定一次，不會在每次 rerun 重寫 ox.settings
+@st.cache_resource(show_spinner=False)
+def _configure_osmnx():
+    import osmnx as ox
+    ox.settings.cache_folder = str(CACHE_DIR.absolute())
+    ox.settings.use_cache = True
+    ox.settings.log_console = False  # 關閉日誌寫入檔案，這常引起權限錯誤
+    return ox
+
+
+# 地理編碼與主題載入結果跨 rerun 共用，同一城市重複生成時不再發出網路請求。
+# create_map_poster 會連帶載入 matplotlib/osmnx/geopandas，延後到第一次按下 GO! 才匯入，
+# 冷啟動時側邊欄可以立即顯示。
+@st.cache_data(ttl=86400, max_entries=128, show_spinner=False)
+def _cached_coords(city, country):
+    from create_map_poster import get_coordinates
+    return get_coordinates(city, country)
+
+
+@st.cache_data(show_spinner=False)
+def _cached_theme(theme_name):
+    from create_map_poster import load_theme
+    return load_theme(theme_name)
+
+
+# 主題與預覽圖清單每分鐘最多重新掃描一次，避免每次操作元件都讀取資料夾
+@st.cache_data(ttl=60, show_spinner=False)
+def _scan_dir(folder, suffix):
+    """回傳資料夾內指定副檔名的檔名 (不含副檔名)，已排序"""
+    try:
+        with os.scandir(folder) as it:
+            return sorted(e.name[:-len(suffix)] for e in it if e.name.endswith(suffix))
+    except FileNotFoundError:
+        return []
+
+
+def _list_themes(folder='themes'):
+    return _scan_dir(folder, '.json') or ["terracotta"]
+
+
+# 繪圖改在背景執行緒進行，腳本執行緒只負責更新進度，介面不會被整段卡住。
+# pyplot 與 create_map_poster.THEME 皆為全域狀態，所以整個程序共用單一 worker 依序繪製。
+@st.cache_resource(show_spinner=False)
+def _executor():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="poster")
+
+
+# 圖資 (graph/water/parks) 以座標與半徑為鍵保留在記憶體中，只調整主題或文字時不必重新讀取；
+# 物件跨 session 共用，使用端不可修改。下載範圍的格網對齊由 fetch_map_data 處理，
+# 相近座標仍共用磁碟上的圖資快取，而海報中心、裁切框與座標標籤都使用精確座標
+@st.cache_resource(max_entries=4, ttl=3600, show_spinner=False)
+def _cached_map_data(lat, lon, dist):
+    _configure_osmnx()
+    from create_map_poster import fetch_map_data
+    return fetch_map_data((lat, lon), dist)
+
+
+# 以所有生成參數為快取鍵，參數不變時直接回傳上次的 PNG bytes，跳過下載與繪圖
+@st.cache_data(max_entries=32, show_spinner=False)
+def _render(city, country, point, dist, theme_name, city_scale, country_scale,
+            line_scale, custom_text, custom_text_size, show_coords) -> bytes:
+    import create_map_poster
+    create_map_poster.THEME = _cached_theme(theme_name)
+    try:
+        map_data = _cached_map_data(point[0], point[1], dist)
+    except Exception as e:
+        raise create_map_poster.MapDataError(str(e)) from e
+    buf = io.BytesIO()
+    create_map_poster.create_poster(
+        city=city,
+        country=country,
+        point=point,
+        dist=dist,
+        output_file=buf,
+        output_format="png",
+        city_scale=city_scale,
+        country_scale=country_scale,
+        line_scale=line_scale,
+        custom_text=custom_text,
+        custom_text_size=custom_text_size,
+        show_coords=show_coords,
+        map_data=map_data
+    )
+    return buf.getvalue()
+
+
+# 頁面預覽只需螢幕解析度：縮成 1200px 的 WebP 傳給瀏覽器，原始 PNG 只留給下載按鈕。
+# 以海報的參數摘要為快取鍵；_png 以底線開頭，Streamlit 不會對整份 PNG 計算雜湊
+@st.cache_data(max_entries=8, show_spinner=False)
+def _preview(poster_key: bytes, _png: bytes) -> bytes:
+    with Image.open(io.BytesIO(_png)) as im:
+        im.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", quality=85)
+    return buf.getvalue()
+
+
+# 程序啟動時就在背景 worker 預先匯入 matplotlib/osmnx 並註冊字體，
+# 第一次按下 GO! 時不必再等框架初始化；之後的繪圖會排在它後面執行。
+@st.cache_resource(show_spinner=False)
+def _warm_up():
+    def _work():
+        _configure_osmnx()
+        import matplotlib.pyplot as plt
+        import create_map_poster
+        create_map_poster.setup_global_fonts()
+        plt.close(plt.figure())
+    return _executor().submit(_work)
+
 
 # 網頁配置
 st.set_page_config(page_title="MapToPoster", page_icon="📍")
+_warm_up()
 st.title("📍 MapToPoster Online")
 st.write("網頁版地圖生成器")
 st.write("輸入城市與國家，生成專屬的極簡風格地圖海報。")
 st.write("Customized stylish map generator")
 
 # --- 側邊欄設定 ---
+# 所有參數放進同一個 st.form，修改時不會每個按鍵都觸發整頁 rerun，按下 GO! 才一次送出。
+# 主題選單留在表單外，預覽圖才能即時切換。
 with st.sidebar:
     st.header("🎨 自訂選項 Options")
+    theme_box = st.container()
+    st.divider()
+
+    with st.form("params", border=False):
+        city = st.text_input("城市 (City)", "Taipei")
+        city_size_opt = st.radio("文字大小 font size", range(3), index=1, format_func=_SIZE_LABELS.__getitem__, horizontal=True, key="city_size")
     
-    city = st.text_input("城市 (City)", "Taipei")
-    city_size_opt = st.radio("文字大小 font size", ["小 S", "中 M", "大 L"], index=1, horizontal=True, key="city_size")
-    
-    country = st.text_input("國家 (Country)", "Taiwan")
-    country_size_opt = st.radio("文字大小 font size", ["小 S", "中 M", "大 L"], index=1, horizontal=True, key="country_size")
+        country = st.text_input("國家 (Country)", "Taiwan")
+        country_size_opt = st.radio("文字大小 font size", range(3), index=1, format_func=_SIZE_LABELS.__getitem__, horizontal=True, key="country_size")
     
-    # 客製化紀念文字
-    custom_text = st.text_input("客製化文字 (選填) Customized text (optional)", placeholder="例如：Our First Date / 2019.02.14")
-    st.caption("目前不支援表情符號 Emoji are not supported")
-    custom_text_size = st.slider("文字大小 font size", 10, 40, 18)
+        # 客製化紀念文字
+        custom_text = st.text_input("客製化文字 (選填) Customized text (optional)", placeholder="例如：Our First Date / 2019.02.14")
+        st.caption("目前不支援表情符號 Emoji are not supported")
+        custom_text_size = st.slider("文字大小 font size", 10, 40, 18)
     
-    # 座標顯示開關
-    # use_manual = st.toggle("手動輸入座標 (Manual input)", value=False)
-    show_coords = st.toggle("顯示經緯度 (Show coordinates)", value=True)
-    use_manual = False
-    if use_manual:
-        st.caption("在 Google Maps 欲製作的地點按右鍵即可複製座標")
-        manual_lat = st.number_input("緯度 Lat", value=0, format="%.4f")
-        manual_lon = st.number_input("經度 Lon", value=0, format="%.4f")
-        coords = (manual_lat, manual_lon)
-    else:
-        coords = None # 由 get_coordinates 自動獲取
-    st.divider()
+        # 座標顯示開關
+        # use_manual = st.toggle("手動輸入座標 (Manual input)", value=False)
+        show_coords = st.toggle("顯示經緯度 (Show coordinates)", value=True)
+        use_manual = False
+        if use_manual:
+            st.caption("在 Google Maps 欲製作的地點按右鍵即可複製座標")
+            manual_lat = st.number_input("緯度 Lat", value=0.0, min_value=-90.0, max_value=90.0, format="%.4f")
+            manual_lon = st.number_input("經度 Lon", value=0.0, min_value=-180.0, max_value=180.0, format="%.4f")
+            # 仍為預設的 (0, 0) 視為尚未填寫，改回自動地理編碼，避免抓取海上的空白圖資
+            manual_coords = (manual_lat, manual_lon) if manual_lat != 0 or manual_lon != 0 else None
+        else:
+            manual_coords = None # 由 get_coordinates 自動獲取
+        st.divider()
 
-    # 地圖半徑控制
-    st.write("地圖半徑 (Map range)")
-    final_dist = st.select_slider(
-        "選擇定點 Radius",
-        options=[2000, 4000, 6000, 8000, 10000, 15000, 20000],
-        value=10000,
-        label_visibility="collapsed" 
-    )
+        # 地圖半徑控制
+        st.write("地圖半徑 (Map range)")
+        final_dist = st.select_slider(
+            "選擇定點 Radius",
+            options=[2000, 4000, 6000, 8000, 10000, 15000, 20000],
+            value=10000,
+            label_visibility="collapsed" 
+        )
 
-    # 線條粗細
-    line_width_opt = st.selectbox("線條粗細 Line width", ["細 Light", "標準 Regular", "粗 Bold"], index=1)
+        # 線條粗細
+        line_width_opt = st.selectbox("線條粗細 Line width", range(3), index=1, format_func=_LINE_LABELS.__getitem__)
 
-    st.divider()
+        generate_btn = st.form_submit_button("GO!", use_container_width=True)
+
+    clear_cache_btn = st.button("🧹 清除地圖快取 Clear map cache", use_container_width=True)
 
     # 主題選擇
-    theme_folder = 'themes'
-    available_themes = []
-    if os.path.exists(theme_folder):
-        available_themes = [f.replace('.json', '') for f in os.listdir(theme_folder) if f.endswith('.json')]
-    
-    if not available_themes:
-        available_themes = ["terracotta"] 
+    available_themes = _list_themes()
     
     #v selected_theme = st.selectbox("選擇主題 (Theme)", available_themes, index=0)
 
 
 
-# 設定預覽圖目錄 (剛才生成的三色帶 PNG)
-PREVIEW_DIR = Path("theme_previews")
-def grid_theme_selector():
-    st.sidebar.subheader("🎨 點擊方塊切換主題")
-    
-    # 核心 CSS：隱藏按鈕視覺，但保留點擊功能並覆蓋全區
-    st.sidebar.markdown("""
+# 預覽 PNG 只讀取並 base64 編碼一次，之後以 data URL 內嵌，瀏覽器直接顯示，
+# 不必每次 rerun 都經過 st.image 的解碼再編碼
+@st.cache_data(show_spinner=False)
+def preview_b64(name: str) -> str:
+    return base64.b64encode((PREVIEW_DIR / f"{name}.png").read_bytes()).decode()
+
+
+@st.cache_data(show_spinner=False)
+def _theme_grid_html(theme_names, selected, cols_per_row=6):
+    """整個預覽網格組成單一段 HTML (圖片以 data URL 內嵌)，一次送到前端"""
+    tiles = []
+    for name in theme_names:
+        b64 = preview_b64(name)
+        selected_class = " selected-tile" if name == selected else ""
+        tiles.append(f'<div class="theme-tile{selected_class}" title="{name}"><img src="data:image/png;base64,{b64}"></div>')
+    return f"""
         <style>
-        /* 1. 定義容器與圖片樣式 */
-        .theme-container {
-            position: relative;
-            width: 100%;
-            cursor: pointer;
-            margin-bottom: -30px; /* 關鍵：強制縮減 Streamlit 預設的按鈕間距 */
-        }
-        .theme-container img {
+        .theme-grid {{
+            display: grid;
+            grid-template-columns: repeat({cols_per_row}, 1fr);
+            gap: 6px;
+            margin-bottom: 8px;
+        }}
+        .theme-tile img {{
             width: 100%;
             border-radius: 8px;
             display: block;
-            transition: transform 0.1s;
-        }
-        /* 2. 選中時的紅色外框 */
-        .selected-tile img {
+        }}
+        /* 選中時的紅色外框 */
+        .selected-tile img {{
             outline: 3px solid #FF4B4B;
             outline-offset: 2px;
-        }
-        /* 3. 徹底隱藏下方的按鈕方框 */
-        .theme-container div[data-testid="stButton"] {
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-        }
-        .theme-container button {
-            width: 100% !important;
-            height: 100% !important;
-            background-color: transparent !important;
-            border: none !important;
-            color: transparent !important;
-            padding: 0 !important;
-            margin: 0 !important;
-            /* 關鍵：讓按鈕完全透明但仍可點擊 */
-            visibility: visible !important;
-        }
-        /* 移除點擊時的任何背景變色 */
-        .theme-container button:hover, .theme-container button:active, .theme-container button:focus {
-            background: transparent !important;
-            box-shadow: none !important;
-            color: transparent !important;
-        }
+        }}
         </style>
-    """, unsafe_allow_html=True)
+        <div class="theme-grid">{"".join(tiles)}</div>
+    """
 
-    theme_files = sorted(list(PREVIEW_DIR.glob("*.png")))
-    if not theme_files:
+
+def grid_theme_selector():
+    st.sidebar.subheader("🎨 點擊方塊切換主題")
+
+    theme_names = _scan_dir(str(PREVIEW_DIR), ".png")
+    if not theme_names:
         st.sidebar.warning("找不到預覽圖")
         return "default"
 
     if "selected_theme" not in st.session_state:
-        st.session_state.selected_theme = theme_files[0].stem
-
-    # 繪製網格
-    cols_per_row = 6
-    for i in range(0, len(theme_files), cols_per_row):
-        cols = st.sidebar.columns(cols_per_row)
-        for j, col in enumerate(cols):
-            if i + j < len(theme_files):
-                theme_path = theme_files[i + j]
-                theme_name = theme_path.stem
-                is_selected = st.session_state.selected_theme == theme_name
-                
-                with col:
-                    # 使用 wrapper div 包裹
-                    selected_class = "selected-tile" if is_selected else ""
-                    st.markdown(f'<div class="theme-container {selected_class}">', unsafe_allow_html=True)
-                    
-                    # 顯示圖片
-                    st.image(str(theme_path), use_container_width=True)
-                    
-                    # 放置透明按鈕，這會透過 CSS 覆蓋在圖片上並消除下方空間
-                    if st.button("", key=f"t_{theme_name}"):
-                        st.session_state.selected_theme = theme_name
-                        st.rerun()
-                    
-                    st.markdown('</div>', unsafe_allow_html=True)
+        st.session_state.selected_theme = theme_names[0]
+
+    # 選擇由單一 radio 元件處理，不再為每個方塊註冊按鈕並呼叫 st.rerun()；網格只負責顯示
+    selected_theme = st.sidebar.radio(
+        "主題 Theme",
+        theme_names,
+        index=theme_names.index(st.session_state.selected_theme),
+        horizontal=True,
+        label_visibility="collapsed"
+    )
+    st.session_state.selected_theme = selected_theme
 
-    return st.session_state.selected_theme
+    st.sidebar.markdown(_theme_grid_html(tuple(theme_names), selected_theme), unsafe_allow_html=True)
+    return selected_theme
 # 在主程式中調用
 # current_theme = grid_theme_selector()
 
 
+# 以 fragment 包裝：切換主題時只重新執行這個區塊 (更新預覽圖)，不必整頁 rerun。
+# 選取結果存在 st.session_state.selected_theme，按下 GO! 的完整 rerun 會讀到最新值。
+@st.fragment
 def theme_selector_with_single_preview():
     # st.sidebar.subheader("🎨 地圖配色 Theme")
     
     # 1. 獲取所有主題清單 (從預覽圖資料夾抓取檔案名稱)
-    theme_files = sorted([f.stem for f in PREVIEW_DIR.glob("*.png")])
+    theme_files = _scan_dir(str(PREVIEW_DIR), ".png")
     
     if not theme_files:
-        st.sidebar.warning("找不到預覽圖，請先執行生成腳本")
+        st.warning("找不到預覽圖，請先執行生成腳本")
         return "default"
 
     # 2. 原生下拉式文字清單
@@ -187,7 +322,7 @@ def theme_selector_with_single_preview():
     if "selected_theme" not in st.session_state:
         st.session_state.selected_theme = theme_files[0]
 
-    selected_theme = st.sidebar.selectbox(
+    selected_theme = st.selectbox(
         "選擇主題配色 Select theme",
         theme_files,
         index=theme_files.index(st.session_state.selected_theme)
@@ -196,14 +331,17 @@ def theme_selector_with_single_preview():
 
    # 3. 調整預覽配置：兩欄顯示
     # 左欄 1/3 寬度，右欄 2/3 寬度
-    col1, col2 = st.sidebar.columns([1, 4])
+    col1, col2 = st.columns([1, 4])
     
-    preview_path = PREVIEW_DIR / f"{selected_theme}.png"
     with col1:
-        # 左側顯示預覽圖：更新為 width='stretch' 以符合 2026 版本規範
-        if preview_path.exists():
-            st.image(str(preview_path), width='stretch')
-        else:
+        # 左側顯示預覽圖 (寬度撐滿欄位)
+        # theme_files 是快取 60 秒的掃描結果，期間預覽檔可能已被刪除，讀不到時顯示替代圖示
+        try:
+            st.markdown(
+                f'<img src="data:image/png;base64,{preview_b64(selected_theme)}" style="width:100%">',
+                unsafe_allow_html=True
+            )
+        except OSError:
             st.write("🖼️")
             
     with col2:
@@ -216,118 +354,134 @@ def theme_selector_with_single_preview():
     return selected_theme
 
 # 在主程式中調用
-selected_theme = theme_selector_with_single_preview()
-
-# 轉換比例係數
-size_map = {"小 S": 0.7, "中 M": 1.0, "大 L": 1.4}
-line_map = {"細 Light": 0.6, "標準 Regular": 1.0, "粗 Bold": 1.6}
+with theme_box:
+    selected_theme = theme_selector_with_single_preview()
 
 # 初始化 Session State
-if 'poster_path' not in st.session_state:
-    st.session_state.poster_path = None
+if 'poster_bytes' not in st.session_state:
+    st.session_state.poster_bytes = None
+    st.session_state.poster_key = None
 
-# --- 主畫面按鈕與 Footer ---
+# --- 主畫面 Footer ---
 st.divider()
 
-col1, col2, col3 = st.columns([1, 1, 1])
-with col2:
-    generate_btn = st.button("GO!", use_container_width=True)
-
-# Footer 標籤
-st.markdown(
-    """
-    <style>
-    .footer {
-        position: fixed;
-        left: 0;
-        bottom: 0;
-        width: 100%;
-        background-color: rgba(0, 0, 0, 0.7); 
-        color: gray;
-        text-align: center;
-        padding: 10px 0;
-        font-size: 0.8em;
-        z-index: 999;
-    }
-    .footer a {
-        text-decoration: none;
-    }
-    .main .block-container {
-        padding-bottom: 80px;
-    }
-    </style>
-    <div class="footer">
-        <span>Source:</span>
-        <a href="https://github.com/originalankur/maptoposter" target="_blank">
-            <img src="https://flat.badgen.net/badge/icon/github?icon=github&label=originalankur/maptoposter&color=black">
-        </a>
-        <span style="margin-left:15px;">Made by:</span>
-        <a href="https://github.com/ynancy22/map-app" target="_blank">
-            <img src="https://flat.badgen.net/badge/icon/github?icon=github&label=ynancy22/map-app&color=cyan">
-        </a>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
+# Footer 標籤 (st.html 直接插入 HTML，前端不必再經過 markdown 解析)
+st.html(_FOOTER_HTML)
 
 
 
-# --- 生成邏輯 ---
-if generate_btn:
+# --- 清除快取 (僅在使用者要求時) ---
+# 地圖圖資快取以座標與半徑為鍵，不需要每次生成都清除；保留座標快取
+if clear_cache_btn:
     # 確保清理時目錄是存在的
     if CACHE_DIR.exists():
         with st.spinner("正在調整暫存數據..."):
-            for pkl in CACHE_DIR.glob("*.pkl"):
-                # 保留座標快取，只刪除地圖圖資
-                if any(prefix in pkl.name for prefix in ["graph_", "water_", "parks_"]):
+            for cached_file in CACHE_DIR.iterdir():
+                # 保留座標快取，只刪除地圖圖資 (不論檔案格式)
+                if cached_file.name.startswith(("graph_", "proj_", "water_", "parks_")):
                     try:
-                        # 使用 os.chmod 確保檔案是可寫入狀態 (預防萬一)
-                        os.chmod(pkl, 0o666) 
-                        pkl.unlink()
-                    except Exception as e:
+                        cached_file.unlink()
+                    except OSError:
                         # 即使刪除失敗也繼續執行，不要讓整個 App 崩潰
-                        st.warning(f"暫時無法清理部分暫存: {pkl.name}")
+                        st.warning(f"暫時無法清理部分暫存: {cached_file.name}")
+    # 記憶體中的圖資與成品快取也一併清除，否則相同參數在 TTL 到期前仍會拿到舊結果
+    _cached_map_data.clear()
+    _render.clear()
+    _preview.clear()
+    st.session_state.pop('poster_cache', None)
 
-    with st.spinner("正在處理數據並繪圖，請稍候... Processing..."):
-        try:
-            # 獲取座標
-            coords = get_coordinates(city, country)
-            create_map_poster.THEME = load_theme(selected_theme)
-            
-            if not os.path.exists("posters"):
-                os.makedirs("posters")
-            
-            output_file = f"posters/{city.replace(' ', '_')}_{selected_theme}.png"
-            
-            # 2. 呼叫核心引擎 (包含 show_coords 參數)
-            create_poster(
-                city=city,
-                country=country,
-                point=coords,
-                dist=final_dist,
-                output_file=output_file,
-                output_format="png",
-                city_scale=size_map[city_size_opt],
-                country_scale=size_map[country_size_opt],
-                line_scale=line_map[line_width_opt],
-                custom_text=custom_text,
-                custom_text_size=custom_text_size,
-                show_coords=show_coords
-            )
-            st.session_state.poster_path = output_file
-        except Exception as e:
-            st.error(f"失敗 Error: {e}")
+# --- 生成邏輯 ---
+safe_city = _SAFE.sub('_', city)
+
+if generate_btn:
+    # 最近生成過的海報 (最多 5 張)，切換回相同參數時直接重新顯示
+    poster_cache = st.session_state.setdefault('poster_cache', collections.OrderedDict())
+    # 固定 16 bytes 的摘要作為字典鍵，查找時不必比對整串參數
+    poster_key = hashlib.blake2b(json.dumps([
+        city, country, final_dist, selected_theme, _SIZE_SCALES[city_size_opt],
+        _SIZE_SCALES[country_size_opt], _LINE_SCALES[line_width_opt],
+        custom_text, custom_text_size, show_coords, manual_coords
+    ]).encode(), digest_size=16).digest()
+
+    if poster_key in poster_cache:
+        poster_cache.move_to_end(poster_key)
+        st.session_state.poster_bytes = poster_cache[poster_key]
+        st.session_state.poster_key = poster_key
+    else:
+        with st.spinner("正在處理數據並繪圖，請稍候... Processing..."):
+            # 各階段分開處理錯誤，訊息能指出是哪一步失敗；已成功的階段結果都在快取中，
+            # 重試時 (例如主題 JSON 修正後) 不會重新下載圖資
+            coords = None
+            try:
+                # 獲取座標 (有手動座標時直接使用，不發出地理編碼請求)
+                lat, lon = manual_coords or _cached_coords(city, country)
+                coords = (lat, lon)
+            except Exception as e:
+                st.error(f"找不到座標 Geocoding failed: {e}")
+
+            theme_ok = False
+            if coords:
+                try:
+                    _cached_theme(selected_theme)
+                    theme_ok = True
+                # 檔案讀取、JSON 格式、缺少必要顏色鍵或頂層不是物件，都以主題錯誤回報
+                except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    st.error(f"主題載入失敗 Theme error ({selected_theme}): {e}")
+
+            if theme_ok:
+                # 2. 呼叫核心引擎 (結果依參數快取)
+                # 若先前同參數的工作因操作元件而中斷，直接接回仍在背景執行的那一個
+                job = st.session_state.get('render_job')
+                if job and job[0] == poster_key and not job[1].cancelled():
+                    future = job[1]
+                else:
+                    # 參數已改變：取消仍在排隊的舊工作，新工作不必等過時的海報畫完
+                    # (已開始執行的工作無法中斷，只能等它結束)
+                    if job:
+                        job[1].cancel()
+                    future = _executor().submit(
+                        _render,
+                        city, country, coords, final_dist, selected_theme,
+                        _SIZE_SCALES[city_size_opt], _SIZE_SCALES[country_size_opt], _LINE_SCALES[line_width_opt],
+                        custom_text, custom_text_size, show_coords
+                    )
+                    st.session_state.render_job = (poster_key, future)
+
+                progress = st.progress(0.0)
+                started = time.monotonic()
+                while not future.done():
+                    time.sleep(0.2)
+                    # 無法得知實際進度，依約一分鐘的典型耗時估算，最多停在 95%
+                    progress.progress(min((time.monotonic() - started) / 60.0, 0.95))
+                progress.empty()
+                st.session_state.render_job = None
+
+                # 例外類別定義在匯入的模組中：腳本每次重跑都會重新定義本檔的類別，
+                # 接回前一次執行送出的工作時，except 必須比對同一個類別
+                from create_map_poster import MapDataError
+                try:
+                    png = future.result()
+                except MapDataError as e:
+                    st.error(f"地圖圖資下載失敗 Map data error: {e.__cause__ or e}")
+                except Exception as e:
+                    st.error(f"繪圖失敗 Rendering error: {e}")
+                else:
+                    st.session_state.poster_bytes = png
+                    st.session_state.poster_key = poster_key
+                    
+                    poster_cache[poster_key] = png
+                    if len(poster_cache) > 5:
+                        poster_cache.popitem(last=False)
 
 # --- 顯示與下載區塊 ---
-if st.session_state.poster_path and os.path.exists(st.session_state.poster_path):
+if st.session_state.poster_bytes:
     st.divider()
-    st.image(st.session_state.poster_path, caption=f"預覽 Preview：{city}")
+    st.image(_preview(st.session_state.poster_key, st.session_state.poster_bytes), caption=f"預覽 Preview：{city}")
     
-    with open(st.session_state.poster_path, "rb") as file:
-        st.download_button(
-            label="💾 下載高解析度海報 Download hi-res graphic",
-            data=file,
-            file_name=f"{city}_poster.png",
-            mime="image/png",
-            use_container_width=True
-        )
+    st.download_button(
+        label="💾 下載高解析度海報 Download hi-res graphic",
+        data=st.session_state.poster_bytes,
+        file_name=f"{safe_city}_poster.png",
+        mime="image/png",
+        use_container_width=True
+    )
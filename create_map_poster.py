@@ -9,26 +9,43 @@ high-quality poster-ready images with roads, water features, and parks.
 
 import argparse
 import asyncio
+import hashlib
+import html
+import io
 import json
+import mmap
 import os
 import pickle
+import struct
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import cast, Optional
+from typing import NamedTuple, Optional
 
 import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path as MplPath
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 import osmnx as ox
-from geopandas import GeoDataFrame
+import pyproj
+import requests
+import shapely
+from geopandas import GeoDataFrame, read_parquet
+from geopy.adapters import RequestsAdapter
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 from lat_lon_parser import parse
 from matplotlib.font_manager import FontProperties
 from networkx import MultiDiGraph
-from shapely.geometry import Point
+from PIL import Image
 from tqdm import tqdm
 
 # 嘗試從本地模組匯入，若失敗則使用內建邏輯
@@ -37,29 +54,100 @@ try:
 except ImportError:
     external_load_fonts = None
 
+# 水域/公園圖層與道路圖的節點/邊表：pyarrow 可用時存成 GeoParquet (zstd)；
+# 否則 pyogrio (geopandas 1.x 預設的 I/O 引擎) 可用時存 FlatGeobuf；兩者皆無才用 pickle
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# 設定 PYROSM_PBF_DIR 且安裝 pyrosm 時，優先從本地 OSM PBF 區域檔讀取圖資，不經 Overpass
+try:
+    import pyrosm
+except ImportError:
+    pyrosm = None
+
+# orjson 可用時用它讀寫座標快取 (較快)，否則退回標準 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 class CacheError(Exception):
     """Raised when a cache operation fails."""
 
+class MapDataError(Exception):
+    """Raised when fetching OSM map data fails (as opposed to drawing)."""
+
 # --- 1. 基礎配置與路徑 (整合環境變數) ---
 CACHE_DIR_PATH = os.environ.get("CACHE_DIR", "cache")
 CACHE_DIR = Path(CACHE_DIR_PATH)
 CACHE_DIR.mkdir(exist_ok=True)
 
+# osmnx 的 Overpass 回應快取：相同查詢 (座標 + 半徑 + 標籤) 直接讀本地 JSON，不再重新下載
+ox.settings.use_cache = True
+ox.settings.cache_folder = str(CACHE_DIR.absolute())
+
 THEMES_DIR = "themes"
 FONTS_DIR = "fonts"
 POSTERS_DIR = "posters"
 FILE_ENCODING = "utf-8"
+THEME_TEXT_KEYS = ("name", "description")
+
+# 道路分級：每個 slot 對應一個主題顏色鍵與線寬；未列出的 highway 類型一律視為住宅道路 (最後一個 slot)
+ROAD_KEYS = ("road_motorway", "road_primary", "road_secondary", "road_tertiary", "road_residential")
+ROAD_WIDTHS = np.array([1.2, 1.0, 0.8, 0.4, 0.4])
+HIGHWAY_SLOTS = {
+    "motorway": 0, "motorway_link": 0,
+    "trunk": 1, "trunk_link": 1, "primary": 1, "primary_link": 1,
+    "secondary": 2, "secondary_link": 2,
+    "tertiary": 3, "tertiary_link": 3,
+}
+RESIDENTIAL_SLOT = len(ROAD_KEYS) - 1
 
 
 # FONTS = load_fonts()
 THEME = {} 
 
+# 路網動輒數十萬個頂點：點陣化前丟掉偏移小於 1 像素的頂點，並把過長的路徑分批交給 Agg
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 1.0
+plt.rcParams['agg.path.chunksize'] = 10000
+
 
 # --- 2. 緩存工具函數 (修正 _cache_path 未定義問題) ---
-def _cache_path(key: str) -> Path:
+def _tags_digest(tags) -> str:
+    """Short content hash of an OSM tag filter, so editing the tags never reuses a stale layer cache."""
+    return hashlib.sha1(json.dumps(tags, sort_keys=True).encode()).hexdigest()[:10]
+
+def _cache_path(key: str, suffix: str = ".pkl") -> Path:
     """產生安全且唯一的緩存檔案路徑"""
     safe = str(key).replace(os.sep, "_").replace("/", "_").replace(":", "_")
-    return CACHE_DIR / f"{safe}.pkl"
+    return CACHE_DIR / f"{safe}{suffix}"
+
+# protocol 5 可把 numpy 陣列等大型緩衝區帶外 (out-of-band) 存到 .bin 旁檔，讀取時以 mmap 映射而非整檔讀入
+PICKLE_OOB = pickle.HIGHEST_PROTOCOL >= 5
+_OOB_ALIGN = 64
+_IO_BUFFER = 1 << 20  # 1 MiB 讀寫緩衝，大型快取檔不必以預設 8 KiB 為單位反覆系統呼叫
+
+def _oob_buffers(key: str):
+    """Map the .bin sidecar and slice out its buffers; layout is [aligned buffers][pickled spans][u64 spans offset]."""
+    bin_path = _cache_path(key, ".bin")
+    if not PICKLE_OOB or not bin_path.exists():
+        return None
+    with open(bin_path, "rb") as bf:
+        # ACCESS_COPY：頁面按需載入，寫入時才複製，不會改到快取檔
+        mm = mmap.mmap(bf.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mm)
+    (spans_at,) = struct.unpack("<Q", view[-8:])
+    spans = pickle.loads(view[spans_at:-8])
+    return [view[start:start + size] for start, size in spans]
 
 def cache_get(key: str):
     """Retrieve a cached object by key."""
@@ -67,8 +155,9 @@ def cache_get(key: str):
         path = _cache_path(key)
         if not path.exists():
             return None
-        with open(path, "rb") as f:
-            return pickle.load(f)
+        buffers = _oob_buffers(key)
+        with open(path, "rb", buffering=_IO_BUFFER) as f:
+            return pickle.Unpickler(f, buffers=buffers).load()
     except Exception as e:
         # 不拋出錯誤，僅回傳 None 讓程式重新抓取數據
         print(f"Cache read info: {e}")
@@ -76,13 +165,130 @@ def cache_get(key: str):
 
 def cache_set(key: str, value):
     """Store an object in the cache."""
+    path = _cache_path(key)
+    bin_path = _cache_path(key, ".bin")
+    tmp = path.with_suffix(".pkl.tmp")
+    bin_tmp = bin_path.with_suffix(".bin.tmp")
     try:
-        path = _cache_path(key)
-        with open(path, "wb") as f:
-            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        buffers = []
+        # 直接串流寫入檔案，不先在記憶體組出整份 pickle
+        with open(tmp, "wb", buffering=_IO_BUFFER) as f:
+            if PICKLE_OOB:
+                pickle.Pickler(f, protocol=5, buffer_callback=buffers.append).dump(value)
+            else:
+                pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(value)
+        if buffers:
+            spans = []
+            with open(bin_tmp, "wb", buffering=_IO_BUFFER) as bf:
+                for buf in buffers:
+                    raw = buf.raw()
+                    bf.write(b"\0" * (-bf.tell() % _OOB_ALIGN))
+                    spans.append((bf.tell(), raw.nbytes))
+                    bf.write(raw)
+                spans_at = bf.tell()
+                bf.write(pickle.dumps(spans, protocol=5))
+                bf.write(struct.pack("<Q", spans_at))
+        # 兩個暫存檔都寫好才動正式檔：先移除舊 .pkl，再換上 .bin，最後換上 .pkl。
+        # 任何一步中斷頂多留下「沒有 .pkl」(快取未命中)，不會出現舊 .pkl 配新 .bin
+        path.unlink(missing_ok=True)
+        if buffers:
+            os.replace(bin_tmp, bin_path)
+        else:
+            bin_path.unlink(missing_ok=True)
+        os.replace(tmp, path)
     except Exception as e:
+        tmp.unlink(missing_ok=True)
+        bin_tmp.unlink(missing_ok=True)
+        print(f"Cache write failed: {e}")
+
+# 座標快取：所有城市存在同一個 coords.json，載入一次後留在記憶體，不再為每個城市讀寫一個 pickle
+COORDS_FILE = CACHE_DIR / "coords.json"
+_coords_lock = threading.Lock()
+
+def _load_coords() -> dict:
+    try:
+        data = COORDS_FILE.read_bytes()
+        return orjson.loads(data) if orjson else json.loads(data)
+    except (OSError, ValueError):
+        return {}
+
+_COORDS = _load_coords()
+
+def _save_coords():
+    """Write the in-memory coords table back atomically (caller holds _coords_lock)."""
+    try:
+        data = orjson.dumps(_COORDS) if orjson else json.dumps(_COORDS, ensure_ascii=False).encode(FILE_ENCODING)
+        tmp = COORDS_FILE.with_suffix(".json.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, COORDS_FILE)
+    except OSError as e:
         print(f"Cache write failed: {e}")
 
+def _table_get(key: str) -> Optional[GeoDataFrame]:
+    """Read a cached geometry table: GeoParquet, then FlatGeobuf. None when neither exists (raises on corrupt files)."""
+    parquet_path, fgb_path = _cache_path(key, ".parquet"), _cache_path(key, ".fgb")
+    if HAS_PYARROW and parquet_path.exists():
+        return read_parquet(parquet_path)
+    if pyogrio is not None and fgb_path.exists():
+        return pyogrio.read_dataframe(fgb_path, use_arrow=HAS_PYARROW)
+    return None
+
+def _table_set(key: str, gdf: GeoDataFrame):
+    """Write a geometry table as zstd GeoParquet (pyarrow) or FlatGeobuf (pyogrio)."""
+    if HAS_PYARROW:
+        # 欄式儲存 + zstd：檔案小，讀取時幾何以 WKB 整欄解碼，不必逐一反序列化 shapely 物件
+        gdf.to_parquet(_cache_path(key, ".parquet"), compression="zstd")
+    else:
+        pyogrio.write_dataframe(gdf, _cache_path(key, ".fgb"), driver="FlatGeobuf")
+
+def cache_get_gdf(key: str) -> Optional[GeoDataFrame]:
+    """Retrieve a cached GeoDataFrame (GeoParquet / FlatGeobuf, else pickle)."""
+    try:
+        gdf = _table_get(key)
+    except Exception as e:
+        print(f"Cache read info: {e}")
+        return None
+    return gdf if gdf is not None else cache_get(key)
+
+def cache_set_gdf(key: str, gdf: GeoDataFrame):
+    """Store a GeoDataFrame; only the geometry column is kept since that is all the poster draws."""
+    if gdf.empty or (not HAS_PYARROW and pyogrio is None):
+        return cache_set(key, gdf)
+    try:
+        _table_set(key, gdf[["geometry"]].reset_index(drop=True))
+    except Exception as e:
+        # 例如不支援的幾何類型，退回 pickle
+        print(f"Cache write info: {e}")
+        cache_set(key, gdf)
+
+def cache_get_graph(key: str) -> Optional[MultiDiGraph]:
+    """Retrieve a cached street graph stored as node/edge geometry tables (pickle fallback)."""
+    try:
+        nodes, edges = _table_get(f"{key}_nodes"), _table_get(f"{key}_edges")
+        if nodes is None or edges is None:
+            return cache_get(key)
+        nodes, edges = nodes.set_index("osmid"), edges.set_index(["u", "v", "key"])
+        return ox.convert.graph_from_gdfs(nodes, edges, graph_attrs={"crs": nodes.crs})
+    except Exception as e:
+        print(f"Cache read info: {e}")
+        return None
+
+def cache_set_graph(key: str, g: MultiDiGraph):
+    """Store a street graph as columnar node/edge tables, keeping only what the poster uses."""
+    if not HAS_PYARROW and pyogrio is None:
+        return cache_set(key, g)
+    try:
+        nodes, edges = ox.convert.graph_to_gdfs(g)
+        nodes = nodes[["x", "y", "geometry"]].reset_index()
+        edges = edges[["highway", "geometry"]].reset_index()
+        # FlatGeobuf 不支援 list 欄位；繪圖本來就只看第一個 highway 類型
+        edges["highway"] = first_highway(edges["highway"])
+        _table_set(f"{key}_edges", edges)
+        _table_set(f"{key}_nodes", nodes)
+    except Exception as e:
+        print(f"Cache write info: {e}")
+        cache_set(key, g)
+
 # --- 3. 字體加載邏輯 (汧水體偵測與回退) ---
 def load_fonts(font_family: Optional[str] = None) -> dict:
 
@@ -105,8 +311,12 @@ def load_fonts(font_family: Optional[str] = None) -> dict:
 def is_latin_script(text):
     """Check if text is primarily Latin script for letter-spacing."""
     if not text: return True
-    latin_count = sum(1 for char in text if char.isalpha() and ord(char) < 0x250)
-    total_alpha = sum(1 for char in text if char.isalpha())
+    # 單次走訪同時計數 (城市名只有數十個字元，isalpha 的判斷與原本完全一致)
+    latin_count = total_alpha = 0
+    for char in text:
+        if char.isalpha():
+            total_alpha += 1
+            latin_count += ord(char) < 0x250
     if total_alpha == 0: return True
     return (latin_count / total_alpha) > 0.8
 
@@ -117,29 +327,51 @@ def generate_output_filename(city, theme_name, output_format):
     city_slug = city.lower().replace(" ", "_")
     return os.path.join(POSTERS_DIR, f"{city_slug}_{theme_name}_{timestamp}.{output_format}")
 
+@lru_cache(maxsize=1)
+def _scan_themes(mtime_ns):
+    """Theme names in THEMES_DIR; mtime_ns only keys the cache so adding/removing a file rescans."""
+    with os.scandir(THEMES_DIR) as it:
+        return tuple(sorted(e.name[:-5] for e in it if e.name.endswith(".json") and e.is_file()))
+
 def get_available_themes():
     """List available themes."""
-    if not os.path.exists(THEMES_DIR): return []
-    return [f[:-5] for f in sorted(os.listdir(THEMES_DIR)) if f.endswith(".json")]
+    try:
+        return list(_scan_themes(os.stat(THEMES_DIR).st_mtime_ns))
+    except FileNotFoundError:
+        return []
 
-def load_theme(theme_name="terracotta"):
-    """Load theme from JSON."""
+@lru_cache(maxsize=16)
+def _load_theme_cached(theme_name):
     theme_file = os.path.join(THEMES_DIR, f"{theme_name}.json")
     if not os.path.exists(theme_file):
-        return {
+        theme = {
             "name": "Terracotta", "bg": "#F5EDE4", "text": "#8B4513",
             "gradient_color": "#F5EDE4", "water": "#A8C4C4", "parks": "#E8E0D0",
             "road_motorway": "#A0522D", "road_primary": "#B8653A", "road_secondary": "#C9846A",
             "road_tertiary": "#D9A08A", "road_residential": "#E5C4B0", "road_default": "#D9A08A",
         }
-    with open(theme_file, "r", encoding=FILE_ENCODING) as f:
-        return json.load(f)
+    else:
+        with open(theme_file, "r", encoding=FILE_ENCODING) as f:
+            theme = json.load(f)
+    # 顏色字串在載入時就轉成 RGBA，繪圖時 matplotlib 不必再逐一解析
+    for k, v in theme.items():
+        if k not in THEME_TEXT_KEYS:
+            theme[k] = mcolors.to_rgba(v)
+    # 各道路分級的顏色陣列，繪圖時以 slot 索引直接取色；沒有 road_residential 的主題用 road_default
+    theme["_palette"] = np.array([theme[k] if k in theme else theme["road_default"] for k in ROAD_KEYS], dtype=np.float32)
+    return theme
+
+def load_theme(theme_name="terracotta"):
+    """Load theme from JSON (parsed once per theme, colours pre-converted to RGBA)."""
+    return dict(_load_theme_cached(theme_name))
 
 # --- 5. 繪圖核心函數 ---
 
+@lru_cache(maxsize=None)
 def setup_global_fonts():
     """
     註冊所有 Roboto 與 Noto Sans TC 字種，並設定全域字體回退機制。
+    只在第一次繪製海報時執行一次 (lru_cache)，匯入模組時不再掃描字體。
     """
     fonts_dir = "fonts"
     # 修正 1：補上 NotoSansTC-Light.ttf 後方遺失的逗號
@@ -169,174 +401,542 @@ def setup_global_fonts():
     # 現在可以安全地印出診斷資訊，不會再報 NameError
     print(f"DEBUG: 成功註冊的 Emoji 字體: {registered_emoji}")
 
-# 執行全域設定
-setup_global_fonts()
 
 
+_ALPHA_UP = np.linspace(0, 1, 256, dtype=np.float32)
+_ALPHA_DOWN = _ALPHA_UP[::-1]
+
+@lru_cache(maxsize=32)
+def _gradient_image(color, location):
+    """(256, 1, 4) RGBA ramp for one fade, built once per (colour, side) and shared by later posters."""
+    img = np.empty((256, 1, 4), dtype=np.float32)
+    img[..., :3] = mcolors.to_rgb(color)
+    img[:, 0, 3] = _ALPHA_DOWN if location == "bottom" else _ALPHA_UP
+    img.flags.writeable = False
+    return img
 
 def create_gradient_fade(ax, color, location="bottom", zorder=10):
     """Creates a fade effect at the top or bottom."""
-    vals = np.linspace(0, 1, 256).reshape(-1, 1)
-    gradient = np.hstack((vals, vals))
-    rgb = mcolors.to_rgb(color)
-    my_colors = np.zeros((256, 4))
-    my_colors[:, :3] = rgb
+    # 直接給 imshow 一張 (256, 1, 4) 的 RGBA 影像，不經 colormap 查表
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
     if location == "bottom":
-        my_colors[:, 3] = np.linspace(1, 0, 256)
-        extent = [ax.get_xlim()[0], ax.get_xlim()[1], ax.get_ylim()[0], ax.get_ylim()[0] + (ax.get_ylim()[1]-ax.get_ylim()[0])*0.25]
+        extent = [x0, x1, y0, y0 + (y1 - y0) * 0.25]
     else:
-        my_colors[:, 3] = np.linspace(0, 1, 256)
-        extent = [ax.get_xlim()[0], ax.get_xlim()[1], ax.get_ylim()[1] - (ax.get_ylim()[1]-ax.get_ylim()[0])*0.25, ax.get_ylim()[1]]
-    
-    ax.imshow(gradient, extent=extent, aspect="auto", cmap=mcolors.ListedColormap(my_colors), zorder=zorder, origin="lower")
-
-def get_edge_colors_by_type(g):
-    edge_colors = []
-    for u, v, data in g.edges(data=True):
-        highway = data.get('highway', 'unclassified')
-        if isinstance(highway, list): highway = highway[0]
-        if highway in ["motorway", "motorway_link"]: color = THEME["road_motorway"]
-        elif highway in ["trunk", "trunk_link", "primary", "primary_link"]: color = THEME["road_primary"]
-        elif highway in ["secondary", "secondary_link"]: color = THEME["road_secondary"]
-        elif highway in ["tertiary", "tertiary_link"]: color = THEME["road_tertiary"]
-        else: color = THEME.get("road_residential", THEME["road_default"])
-        edge_colors.append(color)
-    return edge_colors
-
-def get_edge_widths_by_type(g):
-    edge_widths = []
-    for u, v, data in g.edges(data=True):
-        highway = data.get('highway', 'unclassified')
-        if isinstance(highway, list): highway = highway[0]
-        if highway in ["motorway", "motorway_link"]: width = 1.2
-        elif highway in ["trunk", "trunk_link", "primary", "primary_link"]: width = 1.0
-        elif highway in ["secondary", "secondary_link"]: width = 0.8
-        else: width = 0.4
-        edge_widths.append(width)
-    return edge_widths
+        extent = [x0, x1, y1 - (y1 - y0) * 0.25, y1]
+
+    ax.imshow(_gradient_image(color, location), extent=extent, aspect="auto", zorder=zorder, origin="lower", interpolation="nearest")
+
+def get_edge_geometry_arrays(g_proj, tolerance=0.0):
+    """Theme-independent edge data: one (k, 2) coordinate array per edge plus the categorical highway type.
+
+    Reciprocal edges (u→v and v→u of the same street) are drawn once, and geometries are
+    simplified by ``tolerance`` metres (about half a pixel at print resolution).
+    """
+    edges = ox.convert.graph_to_gdfs(g_proj, nodes=False)
+    u, v, k = (np.asarray(edges.index.get_level_values(i)) for i in range(3))
+    _, first = np.unique(np.column_stack((np.minimum(u, v), np.maximum(u, v), k)), axis=0, return_index=True)
+    edges = edges.iloc[np.sort(first)]
+    geoms = edges.geometry.values
+    if tolerance > 0:
+        geoms = shapely.simplify(np.asarray(geoms), tolerance, preserve_topology=False)
+    coords, idx = shapely.get_coordinates(geoms, return_index=True)
+    segments = np.split(coords, np.flatnonzero(np.diff(idx)) + 1)
+    highway = first_highway(edges["highway"]).fillna("unclassified").astype("category")
+    return segments, highway
+
+def first_highway(highway):
+    """OSM 合併路段的 highway 可能是 list；取第一個類型 (explode 後保留每列第一筆，不逐列呼叫 Python 函式)"""
+    exploded = highway.reset_index(drop=True).explode()
+    return exploded[~exploded.index.duplicated()].set_axis(highway.index)
+
+def get_edge_slots(highway):
+    """Road-class slot (index into ROAD_KEYS) for every edge."""
+    slot_of = np.array([HIGHWAY_SLOTS.get(c, RESIDENTIAL_SLOT) for c in highway.cat.categories], dtype=np.intp)
+    return np.take(slot_of, highway.cat.codes.to_numpy())
+
+# 使用更像瀏覽器的 User-Agent，並加入 timeout；模組層級共用一個 geocoder，
+# RequestsAdapter 內部的 requests.Session 會保留連線，之後的查詢不必重新做 TCP/TLS 握手
+_GEOCODER = Nominatim(
+    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) MapApp/1.0",
+    timeout=10,
+    adapter_factory=RequestsAdapter,
+)
+
+# Nominatim 使用政策為每秒最多 1 個請求：所有呼叫 (包含同時操作的多個 Streamlit session) 共用同一個限速器，
+# 只在真正需要時等待；服務錯誤最多重試 2 次，每次間隔 2 秒
+_rate_limited_geocode = RateLimiter(_GEOCODER.geocode, min_delay_seconds=1, max_retries=2, error_wait_seconds=2, swallow_exceptions=False)
 
 def get_coordinates(city, country):
-    key = f"coords_{city.lower()}_{country.lower()}"
-    cached = cache_get(key)
-    if cached: return cached
-
-    # 使用更像瀏覽器的 User-Agent，並加入 timeout
-    geolocator = Nominatim(
-        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) MapApp/1.0", 
-        timeout=10
-    )
-    # 嘗試最多 3 次，每次失敗後停頓 2 秒
-    for attempt in range(3):
-        try:
-            location = geolocator.geocode(f"{city}, {country}")
-            if location:
-                coords = (location.latitude, location.longitude)
-                cache_set(key, coords)
-                return coords
-        except Exception as e:
-            if attempt < 2:
-                time.sleep(2)
-                continue
-            raise ValueError(f"地理編碼服務暫時不可用 (嘗試 3 次皆失敗): {e}")
-    
-    raise ValueError(f"找不到城市: {city}, {country}")
+    key = f"{city.lower()}|{country.lower()}"
+    cached = _COORDS.get(key)
+    if cached: return tuple(cached)
 
-    geolocator = Nominatim(user_agent="city_map_poster", timeout=10)
-    time.sleep(1)
-    location = geolocator.geocode(f"{city}, {country}")
+    try:
+        location = _rate_limited_geocode(f"{city}, {country}")
+    except Exception as e:
+        raise ValueError(f"地理編碼服務暫時不可用 (嘗試 3 次皆失敗): {e}")
     if location:
         coords = (location.latitude, location.longitude)
-        cache_set(key, coords)
+        with _coords_lock:
+            _COORDS[key] = coords
+            _save_coords()
         return coords
-    raise ValueError(f"Could not find coordinates for {city}")
 
-def get_crop_limits(g_proj, center_lat_lon, fig, dist):
+    raise ValueError(f"找不到城市: {city}, {country}")
+
+def get_crop_limits(g_proj, center_lat_lon, aspect, dist):
     lat, lon = center_lat_lon
-    center = ox.projection.project_geometry(Point(lon, lat), crs="EPSG:4326", to_crs=g_proj.graph["crs"])[0]
-    aspect = fig.get_size_inches()[0] / fig.get_size_inches()[1]
+    cx, cy = get_transformer("EPSG:4326", g_proj.graph["crs"]).transform(lon, lat)
     hx, hy = (dist, dist/aspect) if aspect > 1 else (dist*aspect, dist)
-    return ((center.x - hx, center.x + hx), (center.y - hy, center.y + hy))
+    return ((cx - hx, cx + hx), (cy - hy, cy + hy))
+
+PYROSM_PBF_DIR = os.environ.get("PYROSM_PBF_DIR")
+
+def _bbox_from_point(point, dist):
+    """(west, south, east, north) of the square extending ``dist`` metres from point."""
+    lat, lon = point
+    dlat = dist / 111_320
+    dlon = dist / (111_320 * max(np.cos(np.radians(lat)), 1e-6))
+    return lon - dlon, lat - dlat, lon + dlon, lat + dlat
+
+def _pbf_extents(point, dist):
+    """Yield a pyrosm.OSM reader, limited to the bbox around point, for each local PBF extract."""
+    if pyrosm is None or not PYROSM_PBF_DIR or not os.path.isdir(PYROSM_PBF_DIR):
+        return
+    bbox = list(_bbox_from_point(point, dist))
+    for pbf in sorted(Path(PYROSM_PBF_DIR).glob("*.pbf")):
+        yield pyrosm.OSM(str(pbf), bounding_box=bbox)
+
+def _pyrosm_graph(point, dist) -> Optional[MultiDiGraph]:
+    """Street graph from the first local PBF extract that covers the area, or None to use Overpass."""
+    try:
+        for osm in _pbf_extents(point, dist):
+            network = osm.get_network(network_type="all", nodes=True)
+            if network is not None and not network[1].empty:
+                return osm.to_graph(*network, graph_type="networkx")
+    except Exception as e:
+        print(f"Pyrosm info: {e}")
+    return None
+
+def _pyrosm_features(point, dist, tags) -> Optional[GeoDataFrame]:
+    try:
+        # pyrosm 的篩選條件值必須是 list
+        custom_filter = {k: v if isinstance(v, list) else [v] for k, v in tags.items()}
+        for osm in _pbf_extents(point, dist):
+            data = osm.get_data_by_custom_criteria(custom_filter=custom_filter, filter_type="keep",
+                                                   keep_nodes=False, keep_ways=True, keep_relations=True)
+            if data is not None and not data.empty:
+                return data
+    except Exception as e:
+        print(f"Pyrosm info: {e}")
+    return None
+
+# Overpass 查詢共用一個保持連線的 Session：平行抓水域、公園時可重用 TCP/TLS 連線
+_HTTP = requests.Session()
+_HTTP.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+def _overpass_filters(tags):
+    """osmnx 風格的 tags dict → Overpass QL 標籤條件"""
+    for k, v in tags.items():
+        if v is True:
+            yield f'["{k}"]'
+        else:
+            values = v if isinstance(v, list) else [v]
+            yield f'["{k}"~"^({"|".join(values)})$"]'
+
+def _overpass_polygons(point, dist, tags) -> Optional[GeoDataFrame]:
+    """Polygon features only: query ways and multipolygon relations (no nodes) and assemble them here."""
+    west, south, east, north = _bbox_from_point(point, dist)
+    bbox = f"{south},{west},{north},{east}"
+    parts = "".join(f'way{f}({bbox});relation{f}["type"="multipolygon"]({bbox});' for f in _overpass_filters(tags))
+    timeout = getattr(ox.settings, "requests_timeout", 180)
+    query = f"[out:json][timeout:{timeout}];({parts});out geom;"
+    url = getattr(ox.settings, "overpass_url", None) or getattr(ox.settings, "overpass_endpoint", "https://overpass-api.de/api")
+    try:
+        resp = _HTTP.post(f"{url.rstrip('/')}/interpreter", data={"data": query}, timeout=timeout)
+        resp.raise_for_status()
+        elements = resp.json()["elements"]
+    except Exception as e:
+        print(f"Overpass info: {e}")
+        return None
+
+    # OSM 常有不合法的 multipolygon (difference/union_all 會拋 GEOSException)；組裝失敗時整批改走 OSMnx
+    try:
+        geoms = []
+        for el in elements:
+            if el["type"] == "way":
+                coords = [(p["lon"], p["lat"]) for p in el.get("geometry", [])]
+                # 只有封閉的 way 才是面
+                if len(coords) >= 4 and coords[0] == coords[-1]:
+                    geoms.append(shapely.Polygon(coords))
+            elif el["type"] == "relation":
+                rings = {"outer": [], "inner": []}
+                for m in el.get("members", []):
+                    if m.get("type") == "way" and m.get("role") in rings and len(m.get("geometry", [])) >= 2:
+                        rings[m["role"]].append(shapely.LineString([(p["lon"], p["lat"]) for p in m["geometry"]]))
+                # multipolygon 的外環/內環可能由多段 way 組成，polygonize 把它們接成封閉的面
+                outer = shapely.union_all(shapely.get_parts(shapely.polygonize(rings["outer"])))
+                if rings["inner"]:
+                    outer = outer.difference(shapely.union_all(shapely.get_parts(shapely.polygonize(rings["inner"]))))
+                if not outer.is_empty:
+                    geoms.append(outer)
+    except (shapely.errors.GEOSException, KeyError) as e:
+        print(f"Overpass info: {e}")
+        return None
+    return GeoDataFrame(geometry=geoms, crs="EPSG:4326")
 
 def fetch_graph(point, dist) -> MultiDiGraph:
     key = f"graph_{point[0]}_{point[1]}_{dist}"
-    cached = cache_get(key)
-    if cached: return cast(MultiDiGraph, cached)
-    g = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all', truncate_by_edge=True)
-    cache_set(key, g)
+    cached = cache_get_graph(key)
+    if cached is not None: return cached
+    g = _pyrosm_graph(point, dist)
+    if g is None:
+        g = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all', truncate_by_edge=True)
+    cache_set_graph(key, g)
     return g
 
+def fetch_projected_graph(point, dist) -> MultiDiGraph:
+    """Street graph already projected to UTM; cached separately so project_graph runs once per area."""
+    key = f"proj_{point[0]}_{point[1]}_{dist}"
+    cached = cache_get_graph(key)
+    if cached is not None: return cached
+    g_proj = ox.project_graph(fetch_graph(point, dist))
+    cache_set_graph(key, g_proj)
+    return g_proj
+
 def fetch_features(point, dist, tags, name) -> GeoDataFrame:
-    key = f"{name}_{point[0]}_{point[1]}_{dist}"
-    cached = cache_get(key)
-    if cached: return cast(GeoDataFrame, cached)
-    data = ox.features_from_point(point, tags=tags, dist=dist)
-    cache_set(key, data)
+    key = f"{name}_{point[0]}_{point[1]}_{dist}_{_tags_digest(tags)}"
+    # GeoDataFrame 不能直接當布林值判斷，須用 is not None
+    cached = cache_get_gdf(key)
+    if cached is not None: return cached
+    data = _pyrosm_features(point, dist, tags)
+    if data is None:
+        data = _overpass_polygons(point, dist, tags)
+    if data is None:
+        data = ox.features_from_point(point, tags=tags, dist=dist)
+    cache_set_gdf(key, data)
     return data
 
-def create_poster(city, country, point, dist, output_file, output_format, width=12, height=16, fonts=None, city_scale=1.0, country_scale=1.0, line_scale=1.0, custom_text=None, custom_text_size=18, show_coords=True):
-    # 下載數據
-    comp_dist = dist * (max(height, width) / min(height, width)) / 4
-    g = fetch_graph(point, comp_dist)
-    water = fetch_features(point, comp_dist, {"natural": ["water", "bay"], "waterway": "riverbank"}, "water")
-    parks = fetch_features(point, comp_dist, {"leisure": "park", "landuse": "grass"}, "parks")
-
-    # 設定畫布
-    fig, ax = plt.subplots(figsize=(width, height), facecolor=THEME["bg"])
-    ax.set_position((0, 0, 1, 1))
-    g_proj = ox.project_graph(g)
-
-    # 繪製
-    # 使用 is not None 確保物件存在，使用 not water.empty 確保裡面有資料
-    if water is not None and not water.empty:
-        water.to_crs(g_proj.graph['crs']).plot(ax=ax, facecolor=THEME['water'], edgecolor='none', zorder=0.5)
-
-    if parks is not None and not parks.empty:
-        parks.to_crs(g_proj.graph['crs']).plot(ax=ax, facecolor=THEME['parks'], edgecolor='none', zorder=0.8)
-        
-    widths = [w * line_scale for w in get_edge_widths_by_type(g_proj)]
-    ox.plot_graph(g_proj, ax=ax, bgcolor=THEME['bg'], node_size=0, edge_color=get_edge_colors_by_type(g_proj), edge_linewidth=widths, show=False, close=False)
-    
-    xlim, ylim = get_crop_limits(g_proj, point, fig, comp_dist)
-    ax.set_xlim(xlim); ax.set_ylim(ylim)
-
-    # 裝飾與文字
-    create_gradient_fade(ax, THEME['gradient_color'], 'bottom'); create_gradient_fade(ax, THEME['gradient_color'], 'top')
-    sf = min(height, width) / 12.0
-    # 統一使用的字體家族清單
-    target_family = ['Roboto', 'Noto Sans TC', 'Noto Color Emoji']
-    # target_family = 'sans-serif'
-    # 1. 繪製城市 (City) - 使用 Bold
-    display_city = "  ".join(list(city.upper())) if is_latin_script(city) else city
-    ax.text(0.5, 0.14, display_city, transform=ax.transAxes, color=THEME["text"], 
-            ha="center", fontsize=60 * city_scale * sf, weight='bold',
-            fontfamily=target_family, zorder=11)
-
-    # 2. 繪製國家 (Country) - 使用 Light
-    ax.text(0.5, 0.10, country.upper(), transform=ax.transAxes, color=THEME["text"], 
-            ha="center", fontsize=22 * country_scale * sf, weight='light',
-            fontfamily=target_family, zorder=11)
-
-    coord_y = 0.07  # 座標的預設高度
-    
-    # 繪製座標 (僅在勾選時顯示)
+def compensated_dist(dist, width=12, height=16):
+    """Fetch radius that covers the poster's aspect ratio."""
+    return dist * (max(height, width) / min(height, width)) / 4
+
+class MapData(NamedTuple):
+    """Theme-independent map layers, already projected to the graph's CRS."""
+    graph: MultiDiGraph
+    water: Optional[GeoDataFrame]
+    parks: Optional[GeoDataFrame]
+    roads: tuple  # 依道路分級 (ROAD_KEYS 索引) 分組的邊座標陣列，每組一個 list
+
+def _polygons_only(gdf):
+    if gdf is None or gdf.empty:
+        return gdf
+    return gdf.loc[gdf.geometry.geom_type.isin(("Polygon", "MultiPolygon")).to_numpy()]
+
+@lru_cache(maxsize=16)
+def _cached_transformer(src_wkt, dst_wkt):
+    return pyproj.Transformer.from_crs(src_wkt, dst_wkt, always_xy=True)
+
+def get_transformer(src, dst) -> pyproj.Transformer:
+    """Shared (x, y) transformer per CRS pair, so PROJ set-up happens once rather than per call."""
+    return _cached_transformer(pyproj.CRS(src).to_wkt(), pyproj.CRS(dst).to_wkt())
+
+def _within_bounds(gdf, bounds):
+    """Rows whose bbox intersects ``bounds`` (in the layer's CRS), found through the layer's spatial index."""
+    if gdf is None or gdf.empty:
+        return gdf
+    return gdf.iloc[np.sort(gdf.sindex.query(shapely.box(*bounds)))]
+
+def _project_gdf(gdf, crs) -> GeoDataFrame:
+    """Project a layer's geometries in bulk; only geometry is kept since that is all the poster draws."""
+    if gdf.crs is not None and pyproj.CRS(gdf.crs) == pyproj.CRS(crs):
+        return gdf  # 已在目標座標系，不必重新配置
+    transformer = get_transformer(gdf.crs or "EPSG:4326", crs)
+    geoms = np.array(gdf.geometry.values, dtype=object)
+    coords = shapely.get_coordinates(geoms)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    geoms = shapely.set_coordinates(geoms, np.column_stack((x, y)))
+    return GeoDataFrame(geometry=geoms, crs=crs)
+
+def fetch_projected_features(point, dist, tags, name, graph_future) -> Optional[GeoDataFrame]:
+    """Polygon features already projected to the graph CRS; cached separately so later loads skip reprojection."""
+    key = f"proj_{name}_{point[0]}_{point[1]}_{dist}_{_tags_digest(tags)}"
+    cached = cache_get_gdf(key)
+    if cached is not None: return cached
+    # 先只留下面狀圖徵 (點、線在海報上不會畫) 再投影；目標座標系要等道路圖 (另一個執行緒) 完成才知道
+    data = _polygons_only(fetch_features(point, dist, tags, name))
+    # 投影前先在經緯度下裁到下載範圍 (略放寬，容納投影後邊界的彎曲)：
+    # Overpass 會回傳整個跨出範圍的大型水域/綠地，框外的頂點不必逐一投影
+    bounds = _bbox_from_point(point, dist * 1.1)
+    data = _within_bounds(data, bounds)
+    if data is None or data.empty: return None
+    data = GeoDataFrame(geometry=shapely.clip_by_rect(np.asarray(data.geometry.values), *bounds), crs=data.crs)
+    data = data.loc[~data.geometry.is_empty.to_numpy()]
+    projected = _project_gdf(data, graph_future.result().graph["crs"])
+    cache_set_gdf(key, projected)
+    return projected
+
+def fetch_map_data(point, dist, width=12, height=16) -> MapData:
+    """Fetch and project graph, water and parks; independent of theme and text options."""
+    comp_dist = compensated_dist(dist, width, height)
+    # 下載範圍對齊到固定格網 (中心點約 5 公尺、半徑 50 公尺)，相近的海報共用同一份快取與 Overpass 查詢；
+    # 半徑無條件進位並多留 10 公尺，涵蓋中心點位移，裁切框仍以原本的中心點與半徑計算
+    fetch_point = (round(point[0], 4), round(point[1], 4))
+    fetch_dist = int(np.ceil((comp_dist + 10) / 50) * 50)
+    # 三個 Overpass 查詢互相獨立，平行下載 (等待網路 I/O 時會釋放 GIL)
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_graph = ex.submit(fetch_projected_graph, fetch_point, fetch_dist)
+        f_water = ex.submit(fetch_projected_features, fetch_point, fetch_dist, {"natural": ["water", "bay"], "waterway": "riverbank"}, "water", f_graph)
+        f_parks = ex.submit(fetch_projected_features, fetch_point, fetch_dist, {"leisure": "park", "landuse": "grass"}, "parks", f_graph)
+        g_proj, water, parks = f_graph.result(), f_water.result(), f_parks.result()
+
+    # 投影與道路幾何只跟圖資有關，在這個階段做一次，之後換主題或文字重新繪圖時只需重新對應顏色
+    crs = g_proj.graph['crs']
+    # 快取中的圖層照理已在道路圖的座標系；不一致時 (例如道路圖重新下載) 才重新投影
+    water = _project_gdf(water, crs) if water is not None else None
+    parks = _project_gdf(parks, crs) if parks is not None else None
+    # 下載範圍比海報裁切框大；用空間索引丟掉框外的圖徵，之後繪圖只處理會出現在海報上的部分
+    xlim, ylim = get_crop_limits(g_proj, point, width / height, comp_dist)
+    crop_bounds = (xlim[0], ylim[0], xlim[1], ylim[1])
+    water, parks = _within_bounds(water, crop_bounds), _within_bounds(parks, crop_bounds)
+    # 使用 is not None 確保物件存在，not empty 確保裡面有資料
+    water = water if water is not None and not water.empty else None
+    parks = parks if parks is not None and not parks.empty else None
+    # 以 300 dpi 輸出時裁切範圍內每像素的公尺數，簡化容差取半個像素
+    half_w = comp_dist * min(width / height, 1.0)
+    # 道路分級與分組也只做一次；每次繪圖只需替每組套上主題顏色與線寬
+    segments, highway = get_edge_geometry_arrays(g_proj, tolerance=half_w / (width * 300))
+    slots = get_edge_slots(highway)
+    roads = tuple([segments[i] for i in np.flatnonzero(slots == slot)] for slot in range(len(ROAD_KEYS)))
+    return MapData(g_proj, water, parks, roads)
+
+def polygon_rings(gdf):
+    """All polygon rings of a layer as one contiguous (n, 2) coordinate array plus ring offsets (shapely ragged array).
+
+    Exteriors are clockwise and holes counter-clockwise (shapely.normalize), so either fill rule leaves holes open.
+    """
+    polys = shapely.get_parts(np.asarray(gdf.geometry.values))
+    polys = polys[shapely.get_type_id(polys) == 3]  # 只畫 Polygon；點、線圖徵在海報上沒有面積
+    if len(polys) == 0:
+        return np.empty((0, 2)), np.zeros(1, dtype=np.int64)
+    _, coords, (ring_offsets, _) = shapely.to_ragged_array(shapely.normalize(polys), include_z=False)
+    return coords, ring_offsets
+
+def _add_polygon_layer(ax, gdf, facecolor, zorder):
+    """Draw every polygon of a layer as one compound PathPatch instead of GeoDataFrame.plot's per-polygon patches."""
+    coords, ring_offsets = polygon_rings(gdf)
+    if len(coords) == 0:
+        return
+    # 湖中島、公園內池塘這類內環要留空，所以用單一複合路徑 (MOVETO … CLOSEPOLY) 而不是 PolyCollection
+    codes = np.full(len(coords), MplPath.LINETO, dtype=MplPath.code_type)
+    codes[ring_offsets[:-1]] = MplPath.MOVETO
+    codes[ring_offsets[1:] - 1] = MplPath.CLOSEPOLY
+    ax.add_patch(PathPatch(MplPath(coords, codes), facecolor=facecolor, edgecolor='none', zorder=zorder))
+
+_FIGURE = None
+
+def _reusable_figure(size, facecolor):
+    """Module-wide Agg figure, cleared and resized per poster instead of allocating a new one.
+
+    Like THEME this is process-global state: renders must not run concurrently (the app uses a single worker).
+    The canvas keeps its renderer, so consecutive posters of the same size reuse the pixel buffer.
+    """
+    global _FIGURE
+    if _FIGURE is None:
+        _FIGURE = Figure()
+        FigureCanvasAgg(_FIGURE)
+    fig = _FIGURE
+    fig.clear()
+    fig.set_dpi(plt.rcParams["figure.dpi"])
+    fig.set_size_inches(size)
+    fig.set_facecolor(facecolor)
+    return fig
+
+def _write_output(output_file, write):
+    """Run ``write(f)`` against a file object; for a path, encode into memory first and write the file in one go."""
+    if hasattr(output_file, "write"):
+        return write(output_file)
+    buf = io.BytesIO()
+    write(buf)
+    Path(output_file).write_bytes(buf.getbuffer())
+
+def _canvas_image(fig):
+    """Render the figure once on its Agg canvas and wrap the RGBA buffer (no copy)."""
+    fig.canvas.draw()
+    return Image.frombuffer("RGBA", fig.canvas.get_width_height(), fig.canvas.buffer_rgba(), "raw", "RGBA", 0, 1)
+
+POSTER_PAD = 0.05  # 海報四周留白 (吋)
+# 統一使用的字體家族清單
+TEXT_FAMILY = ('Roboto', 'Noto Sans TC', 'Noto Color Emoji')
+
+def _fmt_coord(lat, lon):
+    """e.g. 25.0330° N / 121.5654° E"""
+    ns = 'N' if lat >= 0 else 'S'
+    ew = 'E' if lon >= 0 else 'W'
+    return f"{abs(lat):.4f}° {ns} / {abs(lon):.4f}° {ew}"
+
+@lru_cache(maxsize=512)
+def _display_city(city):
+    """拉丁字母城市名轉大寫並拉開字距；其他文字維持原樣 (依城市名快取，重繪時不再掃描字串)"""
+    return "  ".join(city.upper()) if is_latin_script(city) else city
+
+def _poster_texts(city, country, point, sf, city_scale, country_scale, custom_text, custom_text_size, show_coords):
+    """Text lines of the poster as (axes y, text, fontsize, weight, alpha, fontfamily), shared by all back ends."""
+    # 1. 城市 (City) - 使用 Bold
+    display_city = _display_city(city)
+    texts = [(0.14, display_city, 60 * city_scale * sf, "bold", None, TEXT_FAMILY),
+             # 2. 國家 (Country) - 使用 Light
+             (0.10, country.upper(), 22 * country_scale * sf, "light", None, TEXT_FAMILY)]
+
+    # 座標 (僅在勾選時顯示)
     if show_coords:
-        lat, lon = point
-        coord_text = f"{abs(lat):.4f}° {'N' if lat>=0 else 'S'} / {abs(lon):.4f}° {'E' if lon>=0 else 'W'}"
-        ax.text(0.5, 0.07, coord_text, transform=ax.transAxes, color=THEME["text"], 
-                alpha=0.7, ha="center", fontsize=14 * sf, zorder=11)        
+        texts.append((0.07, _fmt_coord(*point), 14 * sf, None, 0.7, None))
         # 如果有顯示座標，客製化文字放在比較低的位置
         custom_y = 0.04
     else:
         # 如果隱藏座標，客製化文字往上移動到接近原本座標的位置
         custom_y = 0.06
-   
 
     if custom_text:
-        ax.text(0.5, custom_y, custom_text, transform=ax.transAxes, color=THEME["text"], 
-                alpha=0.8, ha="center", fontsize=custom_text_size * sf,
-                fontfamily=target_family, zorder=11)
-    plt.savefig(output_file, facecolor=THEME["bg"], bbox_inches="tight", pad_inches=0.05, dpi=300)
-    plt.close()
+        texts.append((custom_y, custom_text, custom_text_size * sf, None, 0.8, TEXT_FAMILY))
+    return texts
+
+@lru_cache(maxsize=256)
+def _font_properties(family, size, weight):
+    """FontProperties per (family tuple, size, weight); ax.text copies it, so sharing one instance is safe.
+
+    Callers round size to 0.1 pt so slider-scaled sizes still hit the cache.
+    """
+    return FontProperties(family=list(family) if family else None, size=size, weight=weight)
+
+def _svg_fill(c):
+    """fill 屬性；主題顏色帶透明度時補上 fill-opacity"""
+    alpha = mcolors.to_rgba(c)[3]
+    return f'fill="{mcolors.to_hex(c)}"' + (f' fill-opacity="{alpha:g}"' if alpha < 1 else "")
+
+def save_svg(output_file, width, height, xlim, ylim, water, parks, roads, line_scale, texts):
+    """Write the poster as SVG straight from the geometry arrays: one <path> per layer / road class."""
+    pt = 72  # SVG 使用者單位 = 點 (pt)，與 matplotlib 的線寬、字級一致
+    fig_w, fig_h = (width + 2 * POSTER_PAD) * pt, (height + 2 * POSTER_PAD) * pt
+    ax_x, ax_y, ax_w, ax_h = POSTER_PAD * pt, POSTER_PAD * pt, width * pt, height * pt
+    sx, sy = ax_w / (xlim[1] - xlim[0]), ax_h / (ylim[1] - ylim[0])
+
+    def to_svg(coords):
+        return np.column_stack((ax_x + (coords[:, 0] - xlim[0]) * sx, ax_y + (ylim[1] - coords[:, 1]) * sy))
+
+    def line_d(parts, close=False):
+        tail = "Z" if close else ""
+        return "".join(("M%.2f,%.2f" + "L%.2f,%.2f" * (len(c) - 1) + tail) % tuple(to_svg(c).ravel()) for c in parts)
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{fig_w:g}pt" height="{fig_h:g}pt" viewBox="0 0 {fig_w:g} {fig_h:g}">',
+           f'<defs><clipPath id="map"><rect x="{ax_x:g}" y="{ax_y:g}" width="{ax_w:g}" height="{ax_h:g}"/></clipPath>']
+    grad = mcolors.to_hex(THEME["gradient_color"])
+    for gid, (top, bottom) in {"fade-bottom": (0, 1), "fade-top": (1, 0)}.items():
+        out.append(f'<linearGradient id="{gid}" x1="0" y1="0" x2="0" y2="1">'
+                   f'<stop offset="0" stop-color="{grad}" stop-opacity="{top}"/>'
+                   f'<stop offset="1" stop-color="{grad}" stop-opacity="{bottom}"/></linearGradient>')
+    out.append(f'</defs><rect width="100%" height="100%" {_svg_fill(THEME["bg"])}/><g clip-path="url(#map)">')
+
+    for gdf, key in ((water, "water"), (parks, "parks")):
+        if gdf is None:
+            continue
+        coords, ring_offsets = polygon_rings(gdf)
+        if len(coords):
+            parts = np.split(coords, ring_offsets[1:-1])
+            out.append(f'<path {_svg_fill(THEME[key])} fill-rule="evenodd" d="{line_d(parts, close=True)}"/>')
+
+    # 每個道路分級只輸出一個 <path>；依 slot 由細到粗疊放
+    for slot in range(len(ROAD_KEYS) - 1, -1, -1):
+        parts = roads[slot]
+        if parts:
+            out.append(f'<path fill="none" stroke="{mcolors.to_hex(THEME["_palette"][slot])}" '
+                       f'stroke-width="{ROAD_WIDTHS[slot] * line_scale:g}" d="{line_d(parts)}"/>')
+
+    fade_h = ax_h * 0.25
+    out.append(f'<rect x="{ax_x:g}" y="{ax_y + ax_h - fade_h:g}" width="{ax_w:g}" height="{fade_h:g}" fill="url(#fade-bottom)"/>'
+               f'<rect x="{ax_x:g}" y="{ax_y:g}" width="{ax_w:g}" height="{fade_h:g}" fill="url(#fade-top)"/></g>')
+
+    for y, text, size, weight, alpha, family in texts:
+        attrs = f'x="{ax_x + ax_w / 2:g}" y="{ax_y + ax_h * (1 - y):.2f}" font-size="{size:.2f}" text-anchor="middle" {_svg_fill(THEME["text"])}'
+        if weight:
+            attrs += f' font-weight="{700 if weight == "bold" else 300}"'
+        if alpha is not None:
+            attrs += f' opacity="{alpha:g}"'
+        fonts = ", ".join(f"'{f}'" for f in (family or [])) + (", " if family else "") + "sans-serif"
+        out.append(f'<text {attrs} font-family="{fonts}" xml:space="preserve">{html.escape(text)}</text>')
+    out.append("</svg>")
+
+    data = "\n".join(out).encode(FILE_ENCODING)
+    _write_output(output_file, lambda f: f.write(data))
+
+def build_poster_renderer(city, country, point, dist, width=12, height=16, city_scale=1.0, country_scale=1.0, line_scale=1.0, custom_text=None, custom_text_size=18, show_coords=True, map_data=None):
+    """Precompute everything that does not depend on the theme and return ``render(output_file, output_format, return_image=False)``.
+
+    render() draws with whatever THEME is current, so several themes can be rendered from one builder.
+    """
+    # 下載數據 (呼叫端可傳入 fetch_map_data 的結果以重複使用，這裡不會修改它)
+    comp_dist = compensated_dist(dist, width, height)
+    if map_data is None:
+        map_data = fetch_map_data(point, dist, width, height)
+    g_proj, water, parks, roads = map_data
+    xlim, ylim = get_crop_limits(g_proj, point, width / height, comp_dist)
+    sf = min(height, width) / 12.0
+    texts = _poster_texts(city, country, point, sf, city_scale, country_scale, custom_text, custom_text_size, show_coords)
+    def render(output_file, output_format, return_image=False):
+        setup_global_fonts()
+        # SVG 直接由幾何陣列輸出，不經 matplotlib 的 SVG 後端 (否則每條路都是一個 <path>)
+        if output_format == "svg" and not return_image:
+            save_svg(output_file, width, height, xlim, ylim, water, parks, roads, line_scale, texts)
+            return
+
+        # 設定畫布
+        # 四周留白直接算進畫布尺寸，存檔時不需要 bbox_inches="tight" 再掃一遍所有 artist
+        fig_w, fig_h = width + 2 * POSTER_PAD, height + 2 * POSTER_PAD
+        fig = _reusable_figure((fig_w, fig_h), THEME["bg"])
+        ax = fig.add_axes((POSTER_PAD / fig_w, POSTER_PAD / fig_h, width / fig_w, height / fig_h))
+
+        # 繪製
+        if water is not None:
+            _add_polygon_layer(ax, water, THEME['water'], zorder=0.5)
+
+        if parks is not None:
+            _add_polygon_layer(ax, parks, THEME['parks'], zorder=0.8)
+
+        # 每個道路分級一個單色、單一線寬的 LineCollection，不經過 ox.plot_graph 逐邊建立 artist；
+        # 由住宅道路畫到高速公路，主要道路疊在上層
+        # PDF 等向量格式：數萬條道路點陣化成 300 dpi 影像，文字與漸層仍保持向量
+        ax.set_facecolor(THEME['bg']); ax.axis('off')
+        for slot in range(len(ROAD_KEYS) - 1, -1, -1):
+            if roads[slot]:
+                ax.add_collection(LineCollection(roads[slot], colors=[THEME["_palette"][slot]],
+                                                 linewidths=ROAD_WIDTHS[slot] * line_scale, zorder=1,
+                                                 rasterized=output_format != "png"))
+        ax.set_xlim(xlim); ax.set_ylim(ylim)
+
+        # 裝飾與文字
+        create_gradient_fade(ax, THEME['gradient_color'], 'bottom'); create_gradient_fade(ax, THEME['gradient_color'], 'top')
+        for y, text, size, weight, alpha, family in texts:
+            ax.text(0.5, y, text, transform=ax.transAxes, color=THEME["text"], ha="center",
+                    fontproperties=_font_properties(family, round(size, 1), weight), alpha=alpha, zorder=11)
+
+        # 只需要預覽影像時直接取用 Agg 畫布的 RGBA 緩衝區，省去 PNG 編碼再解碼
+        if return_image:
+            return _canvas_image(fig).copy()
+
+        # PNG：直接把 Agg 畫布存檔，不經 savefig
+        if output_format == "png":
+            fig.set_dpi(300)
+            _write_output(output_file, lambda f: _canvas_image(fig).save(f, format="PNG", compress_level=1))
+            return
+
+        _write_output(output_file, lambda f: fig.savefig(f, format=output_format, facecolor=THEME["bg"], dpi=300))
+
+    return render
+
+def create_poster(city, country, point, dist, output_file, output_format, width=12, height=16, fonts=None, city_scale=1.0, country_scale=1.0, line_scale=1.0, custom_text=None, custom_text_size=18, show_coords=True, return_image=False, map_data=None):
+    render = build_poster_renderer(city, country, point, dist, width, height, city_scale, country_scale, line_scale,
+                                   custom_text, custom_text_size, show_coords, map_data)
+    return render(output_file, output_format, return_image)
 
 # --- 6. CLI 介面 (保持您的 argparse 邏輯) ---
 if __name__ == "__main__":
@@ -5,15 +5,68 @@ Handles font loading, Google Fonts integration, and caching.
 
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 import matplotlib.font_manager as fm
 
 FONTS_DIR = "fonts"
 FONTS_CACHE_DIR = Path(FONTS_DIR) / "cache"
 
+# One keep-alive session for the stylesheet and font files, so downloads
+# reuse connections instead of a TLS handshake per request
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# font-weight and its src url() within one @font-face block ([^}] keeps the match inside the block)
+_FONT_FACE_RE = re.compile(
+    r"font-weight:\s*(\d+)[^}]*?url\((https://[^)]+?\.(?:woff2|ttf))\)"
+)
+
+
+def _conditional_get(url: str, cache_path: Path, **kwargs) -> bytes:
+    """
+    GET url, revalidating a cached copy with its stored ETag.
+    On 304 the cached body is returned; otherwise the new body and ETag are cached.
+    """
+    etag_path = cache_path.with_name(cache_path.name + ".etag")
+    headers = dict(kwargs.pop("headers", None) or {})
+    if cache_path.exists() and etag_path.exists():
+        headers["If-None-Match"] = etag_path.read_text().strip()
+
+    response = _SESSION.get(url, headers=headers, **kwargs)
+    if response.status_code == 304:
+        return cache_path.read_bytes()
+    response.raise_for_status()
+
+    cache_path.write_bytes(response.content)
+    etag = response.headers.get("ETag")
+    if etag:
+        etag_path.write_text(etag)
+    elif etag_path.exists():
+        etag_path.unlink()
+    return response.content
+
+
+def _download_font(url: str, font_path: Path) -> Optional[Exception]:
+    """Download one font file; returns the error instead of raising so other weights still complete."""
+    # Stream to a .part file and rename, so an interrupted download never leaves a truncated font in the cache
+    part_path = font_path.with_name(font_path.name + ".part")
+    try:
+        with _SESSION.get(url, stream=True, timeout=10) as font_response:
+            font_response.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in font_response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+        os.replace(part_path, font_path)
+    except Exception as e:
+        part_path.unlink(missing_ok=True)
+        return e
+    return None
+
 
 def download_google_font(font_family: str, weights: list = None) -> Optional[dict]:
     """
@@ -46,35 +99,25 @@ def download_google_font(font_family: str, weights: list = None) -> Optional[dic
             "User-Agent": "Mozilla/5.0"  # Get .woff2 files (better compression)
         }
 
-        # Fetch CSS file
-        response = requests.get(api_url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        css_content = response.text
+        # Fetch CSS file (revalidated with If-None-Match, so an unchanged stylesheet is a 304)
+        css_path = FONTS_CACHE_DIR / f"{font_name_safe}_{'_'.join(map(str, weights))}.css"
+        css_content = _conditional_get(
+            api_url, css_path, params=params, headers=headers, timeout=10
+        ).decode("utf-8")
 
         # Parse CSS to extract weight-specific URLs
         # Google Fonts CSS has @font-face blocks with font-weight and src: url()
-        weight_url_map = {}
-
-        # Split CSS into font-face blocks
-        font_face_blocks = re.split(r"@font-face\s*\{", css_content)
-
-        for block in font_face_blocks[1:]:  # Skip first empty split
-            # Extract font-weight
-            weight_match = re.search(r"font-weight:\s*(\d+)", block)
-            if not weight_match:
-                continue
-
-            weight = int(weight_match.group(1))
-
-            # Extract URL (prefer woff2, fallback to ttf)
-            url_match = re.search(r"url\((https://[^)]+\.(woff2|ttf))\)", block)
-            if url_match:
-                weight_url_map[weight] = url_match.group(1)
+        # One pass over the stylesheet; later blocks for the same weight win
+        weight_url_map = {
+            int(m.group(1)): m.group(2) for m in _FONT_FACE_RE.finditer(css_content)
+        }
 
         # Map weights to our keys
         weight_map = {300: "light", 400: "regular", 700: "bold"}
 
-        # Download each weight
+        # Resolve a file per weight; missing files are downloaded afterwards
+        wanted = []
+        downloads = []
         for weight in weights:
             weight_key = weight_map.get(weight, "regular")
 
@@ -100,19 +143,29 @@ def download_google_font(font_family: str, weights: list = None) -> Optional[dic
                 font_filename = f"{font_name_safe}_{weight_key}.{file_ext}"
                 font_path = FONTS_CACHE_DIR / font_filename
 
-                if not font_path.exists():
+                if any(font_path == task[2] for task in downloads):
+                    pass  # Same file already queued by another weight
+                elif not font_path.exists():
                     print(f"  Downloading {font_family} {weight_key} ({weight})...")
-                    try:
-                        font_response = requests.get(weight_url, timeout=10)
-                        font_response.raise_for_status()
-                        font_path.write_bytes(font_response.content)
-                    except Exception as e:
-                        print(f"  ⚠ Failed to download {weight_key}: {e}")
-                        continue
+                    downloads.append((weight_key, weight_url, font_path))
                 else:
                     print(f"  Using cached {font_family} {weight_key}")
 
-                font_files[weight_key] = str(font_path)
+                wanted.append((weight_key, font_path))
+
+        # Missing weights download concurrently rather than one after another
+        if downloads:
+            with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+                results = executor.map(lambda task: _download_font(*task[1:]), downloads)
+                failed = set()
+                for (weight_key, _, font_path), error in zip(downloads, results):
+                    if error is not None:
+                        print(f"  ⚠ Failed to download {weight_key}: {error}")
+                        failed.add(font_path)
+            wanted = [(key, path) for key, path in wanted if path not in failed]
+
+        for weight_key, font_path in wanted:
+            font_files[weight_key] = str(font_path)
 
         # Ensure we have at least regular weight
         if "regular" not in font_files and font_files: